@@ -1,19 +1,37 @@
+import re
+
 import requests
-from bs4 import BeautifulSoup
+import soupsieve as sv
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 URL = "https://sprint-rowery.pl/rowery"
 HEADERS = {
     "User-Agent": "Mozilla/5.0"
 }
 
-response = requests.get(URL, headers=HEADERS)
-soup = BeautifulSoup(response.text, "html.parser")
+# при разборе class ещё сырая строка ("product-wrapper col-md-4"), поэтому ищем токен регуляркой
+ONLY_PRODUCTS = SoupStrainer("div", class_=re.compile(r"(?:^|\s)product-wrapper(?:\s|$)"))
+PRODUCT = sv.compile("div.product-wrapper")
+TITLE = sv.compile("a.product-name")
+PRICE = sv.compile("span.price")
+
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+# повторяем и на 429/5xx, выдерживая Retry-After, а не только на сетевых ошибках
+RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+              respect_retry_after_header=True)
+SESSION.mount("https://", HTTPAdapter(pool_maxsize=4, max_retries=RETRY))
+
+response = SESSION.get(URL, timeout=30)
+soup = BeautifulSoup(response.content, "lxml", parse_only=ONLY_PRODUCTS)
 
-products = soup.select("div.product-wrapper")
+products = PRODUCT.select(soup)
 
 for i, product in enumerate(products, 1):
-    title_elem = product.select_one("a.product-name")
-    price_elem = product.select_one("span.price")
+    title_elem = TITLE.select_one(product)
+    price_elem = PRICE.select_one(product)
 
     title = title_elem.get_text(strip=True) if title_elem else "Без названия"
     link = "https://sprint-rowery.pl" + title_elem['href'] if title_elem else "—"
@@ -2,37 +2,69 @@
 """
 Sprint-Rowery scraper with JS rendering + полная диагностика.
 Требования (в активированном venv):
-    pip install requests-html lxml lxml_html_clean pandas openpyxl
+    pip install playwright lxml aiohttp brotli aiolimiter "beautifulsoup4>=4.13" soupsieve selectolax orjson
+    pip install xlsxwriter                 # только для --xlsx
+    pip install pyarrow                    # только для --parquet
+    pip install aiohttp-client-cache aiosqlite   # только для --cache
+    playwright install chromium
 Запуск:
-    python parser.py
+    python parser.py [--xlsx] [--parquet] [--cache [--refresh]]
+    SCRAPER_DEBUG=1 python parser.py       # + HTML-дампы для диагностики
 Результат:
-    raw_page.html, rendered_page.html, debug_page_*.html, debug_product_*.html
-    output.csv, output.xlsx
+    output.csv (пишется по мере обхода), output.xlsx (с --xlsx), output.parquet (с --parquet)
+    raw_page.html, rendered_page.html, debug_page_*.html, debug_product_*.html (с SCRAPER_DEBUG)
 """
 
+import argparse
+import asyncio
+import csv
 import os
 import re
+import sys
 import time
-from dataclasses import dataclass, asdict
-from typing import List, Optional, Tuple
-from urllib.parse import urljoin, urlparse
-
-import pandas as pd
-from requests_html import HTMLSession
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from html import unescape
+from operator import attrgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urldefrag, urljoin, urlsplit
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+import orjson
+import soupsieve as sv
+from bs4 import BeautifulSoup
+from bs4.filter import ElementFilter
+from playwright.async_api import BrowserContext, async_playwright
+from selectolax.lexbor import LexborHTMLParser
 
 BASE_URL = "https://sprint-rowery.pl"
 START_PATH = "/rowery"                 # корневая категория
 RENDER_TIMEOUT = 30
 RETRIES = 3
-SLEEP = 1.0
-SAVE_DEBUG = True
+RETRY_STATUSES = (429, 500, 502, 503, 504)   # остальные ошибки HTTP повтором не лечатся
+MAX_RETRY_AFTER = 60                   # сек; дольше не ждём, даже если сервер просит
+RATE_LIMIT = 8                         # запросов в секунду к сайту, суммарно по всем задачам
+SAVE_DEBUG = bool(os.getenv("SCRAPER_DEBUG"))
+DEBUG_LIMIT = 5                        # сколько страниц листинга/товаров дампить
 MAX_PAGES = 0                          # 0 = без лимита (если нужно ограничить, поставьте число)
+MAX_WORKERS = 8                        # размер пула keep-alive соединений
+PER_HOST_CONCURRENCY = 6               # одновременных запросов к одному хосту
+RENDER_CONCURRENCY = 4                 # одновременно открытых вкладок браузера
+PREFIX_BYTES = 32768                   # начало страницы товара, где обычно лежит JSON-LD
+PARQUET_BATCH = 1000                   # строк в row group output.parquet
+CACHE_NAME = "http_cache.sqlite"       # дисковый HTTP-кэш страниц товаров (--cache)
+CACHE_EXPIRE = 86400                   # сек; Cache-Control сервера имеет приоритет
 
 HEADERS = {
     "User-Agent": ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
                    "AppleWebKit/537.36 (KHTML, like Gecko) "
                    "Chrome/124.0.0.0 Safari/537.36"),
     "Accept-Language": "pl,en;q=0.9,ru;q=0.8",
+    # Accept-Encoding не задаём: aiohttp сам добавляет br/zstd, только если их пакеты установлены
 }
 
 @dataclass
@@ -44,158 +76,484 @@ class Product:
     category: str
     description: str
 
+FIELDS = [f.name for f in fields(Product)]
+product_row = attrgetter(*FIELDS)      # Product -> кортеж значений в порядке колонок, без копий как в asdict
+
+@dataclass
+class ListPage:
+    links: List[str]
+    next_url: Optional[str]
+    known: Dict[str, Product]          # товары, целиком взятые из JSON-LD листинга
+    last_page: int = 0                 # номер последней страницы по пагинации; 0 — неизвестен
+
 
 # ---------- утилиты ----------
 def abs_url(href: str) -> str:
-    return href if href.startswith("http") else urljoin(BASE_URL, href)
+    if href.startswith("http"):
+        return href
+    # самый частый случай — путь от корня: склеиваем строкой, без разбора URL
+    if href.startswith("/") and not href.startswith("//"):
+        return BASE_URL + href
+    return urljoin(BASE_URL, href)
+
+def list_url(page: int) -> str:
+    return abs_url(f"{START_PATH}?page={page}")
 
 def norm(text: Optional[str]) -> str:
     return re.sub(r"\s+", " ", (text or "")).strip()
 
+TAG_RE = re.compile(r"<[^>]+>")
+
+def strip_tags(text: str) -> str:
+    """Текст из HTML-фрагмента (описание в JSON-LD) без построения дерева."""
+    return norm(unescape(TAG_RE.sub(" ", text)))
+
+PRODUCT_PATH_RE = re.compile(r"/(?:rower|produkt|product)", re.IGNORECASE)
+
+@lru_cache(maxsize=4096)                # меню/футер повторяются на каждой странице листинга
 def is_product_link(href: str) -> bool:
     if not href or href.startswith(("#", "mailto:", "tel:")):
         return False
-    path = urlparse(href).path.lower()
-    return any(k in path for k in ("/rower", "/produkt", "/product"))
+    return PRODUCT_PATH_RE.search(urlsplit(href).path) is not None
 
-def save_file(name: str, data: str):
-    with open(name, "w", encoding="utf-8") as f:
-        f.write(data)
+def save_file(name: str, data: Union[str, bytes]):
+    if isinstance(data, bytes):
+        with open(name, "wb") as f:
+            f.write(data)
+    else:
+        with open(name, "w", encoding="utf-8") as f:
+            f.write(data)
     print(f"[SAVE] {os.path.abspath(name)}")
 
-def session() -> HTMLSession:
-    s = HTMLSession()
-    s.headers.update(HEADERS)
-    return s
+# дампы пишет отдельный поток, чтобы диск не тормозил обход
+DEBUG_POOL = ThreadPoolExecutor(max_workers=1) if SAVE_DEBUG else None
+
+def save_debug(name: str, data: Union[str, bytes]):
+    if DEBUG_POOL:
+        DEBUG_POOL.submit(save_file, name, data)
+
+def select_first(soup: BeautifulSoup, selectors):
+    # порядок селекторов — приоритет; пустые теги (img, meta) в bool дают False
+    for sel in selectors:
+        el = sel.select_one(soup)
+        if el is not None:
+            return el
+    return None
+
+RENDER_SEM = asyncio.Semaphore(RENDER_CONCURRENCY)
+# token bucket: параллельность задают семафор/пул соединений, нагрузку на сайт — лимитер
+LIMITER = AsyncLimiter(RATE_LIMIT, 1)
+# ожидание в очереди к хосту не должно съедать таймаут самого запроса, поэтому семафор, а не limit_per_host
+HOST_SEMS = defaultdict(lambda: asyncio.Semaphore(PER_HOST_CONCURRENCY))
 
-def render(url: str):
-    s = session()
+async def render(context: BrowserContext, url: str) -> Optional[str]:
+    """HTML страницы после выполнения JS; вкладка открывается в общем контексте браузера."""
+    async with RENDER_SEM:
+        return await render_page(context, url)
+
+async def render_page(context: BrowserContext, url: str) -> Optional[str]:
+    first_page = SAVE_DEBUG and ("page=1" in url or url.endswith(START_PATH) or url.endswith(START_PATH + "/"))
     last_err = None
     for attempt in range(1, RETRIES + 1):
+        page = await context.new_page()
         try:
-            r = s.get(url, timeout=30)
+            await LIMITER.acquire()
+            resp = await page.goto(url, timeout=RENDER_TIMEOUT * 1000, wait_until="networkidle")
             # сохраняем сырой HTML первой страницы для диагностики
-            if "page=1" in url or url.endswith(START_PATH) or url.endswith(START_PATH + "/"):
-                save_file("raw_page.html", r.text)
-
-            r.html.render(timeout=RENDER_TIMEOUT, sleep=1.0, reload=False, keep_page=True)
-            html = r.html.html or ""
-            if "page=1" in url or url.endswith(START_PATH) or url.endswith(START_PATH + "/"):
-                save_file("rendered_page.html", html)
-
-            if r.status_code == 200 and html:
-                return r
+            if first_page and resp:
+                save_debug("raw_page.html", await resp.body())
+
+            html = await page.content()
+            if first_page:
+                save_debug("rendered_page.html", html)
+
+            if resp and resp.status == 200 and html:
+                return html
+            last_err = f"HTTP {resp.status if resp else '—'}"
+            # как в fetch_html: 404 и прочие постоянные ошибки повтором не лечатся
+            if resp and resp.status != 200 and resp.status not in RETRY_STATUSES:
+                break
         except Exception as e:
             last_err = e
-            time.sleep(1.2 * attempt)
+        finally:
+            await page.close()
+        if attempt < RETRIES:
+            await asyncio.sleep(1.2 * 2 ** (attempt - 1))
     print(f"[FAIL] render {url} -> {last_err}")
     return None
 
+async def fetch_html(http: aiohttp.ClientSession, url: str, limit: int = 0,
+                     refresh: bool = False) -> Tuple[Optional[bytes], bool]:
+    """Сырой HTML без JS-рендеринга — для страниц товаров.
+
+    Возвращает байты (кодировку по <meta charset> определяет парсер) и флаг,
+    получен ли документ целиком. С limit запрашиваются только первые limit
+    байт через Range; сервер вправе его проигнорировать и отдать всё.
+    refresh (только для CachedSession) сверяет кэш с сервером условным запросом.
+    """
+    # Range считается по закодированному телу, поэтому просим без сжатия
+    headers = {"Range": f"bytes=0-{limit - 1}", "Accept-Encoding": "identity"} if limit else None
+    # If-None-Match / If-Modified-Since из закэшированного ответа; на 304 отдаётся тело из кэша
+    extra = {"refresh": True} if refresh else {}
+
+    # свежее попадание в кэш (--cache) отдаём сразу: слот хоста и токен лимитера нужны только сети;
+    # ключ строится как в CachedSession — по заголовкам сессии с наложенными заголовками запроса
+    cache = getattr(http, "cache", None)
+    if cache is not None and not refresh:
+        cached = await cache.get_response(cache.create_key("GET", url, headers={**HEADERS, **(headers or {})}))
+        if cached is not None:
+            body = await cached.read()
+            return body, cached.status == 200 or len(body) < limit
+
+    last_err = None
+    for attempt in range(1, RETRIES + 1):
+        # экспоненциальная пауза; Retry-After сервера (429/503) важнее
+        delay = 1.2 * 2 ** (attempt - 1)
+        try:
+            async with HOST_SEMS[urlsplit(url).netloc]:
+                await LIMITER.acquire()
+                async with http.get(url, headers=headers, **extra) as r:
+                    if r.status in (200, 206):
+                        body = await r.read()
+                        return body, r.status == 200 or len(body) < limit
+                    last_err = f"HTTP {r.status}"
+                    if r.status not in RETRY_STATUSES:
+                        break
+                    retry_after = r.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        delay = min(int(retry_after), MAX_RETRY_AFTER)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_err = e
+        # пауза вне семафора: ожидающий повтора не занимает слот хоста
+        if attempt < RETRIES:
+            await asyncio.sleep(delay)
+    print(f"[FAIL] fetch {url} -> {last_err}")
+    return None, False
+
+
+# ---------- JSON-LD ----------
+LD_JSON_SELECTOR = sv.compile('script[type="application/ld+json"]')
+LD_JSON_CSS = 'script[type="application/ld+json"]'
+# тело <script type="application/ld+json"> прямо из байтов страницы, без построения DOM
+LD_JSON_RE = re.compile(rb"""<script[^>]*type=["']?application/ld\+json["']?[^>]*>(.*?)</script>""",
+                        re.DOTALL | re.IGNORECASE)
+LD_PRODUCT_TYPES = ("Product", "Bike", "Thing")
+
+def walk_ld(data) -> Iterator[dict]:
+    if isinstance(data, list):
+        for d in data:
+            yield from walk_ld(d)
+    elif isinstance(data, dict):
+        if data.get("@type") in LD_PRODUCT_TYPES:
+            yield data
+        for key in ("@graph", "itemListElement", "item"):
+            if key in data:
+                yield from walk_ld(data[key])
+
+def load_ld(scripts: Iterable[Union[str, bytes, None]]) -> List:
+    """Разобранные блоки ld+json; битые пропускаются."""
+    blocks = []
+    for text in scripts:
+        try:
+            # orjson не принимает подклассы str (NavigableString) — отдаём байты
+            blocks.append(orjson.loads(text.encode() if isinstance(text, str) else text or b""))
+        except orjson.JSONDecodeError:
+            continue
+    return blocks
+
+def top_ld(data) -> Iterator[dict]:
+    """Product верхнего уровня и из @graph — без элементов ItemList (похожие товары и т.п.)."""
+    if isinstance(data, list):
+        for d in data:
+            yield from top_ld(d)
+    elif isinstance(data, dict):
+        if data.get("@type") in LD_PRODUCT_TYPES:
+            yield data
+        if "@graph" in data:
+            yield from top_ld(data["@graph"])
+
+def own_ld(blocks: List, url: str) -> Optional[dict]:
+    """JSON-LD самого товара страницы url: Product верхнего уровня, чей url/@id совпадает с url,
+    а если ссылок у них нет — первый такой. Product со ссылкой на другой товар не подходит."""
+    url = urldefrag(url).url
+    fallback = None
+    for data in top_ld(blocks):
+        link = ld_link(data)
+        if link == url:
+            return data
+        if not link and fallback is None:
+            fallback = data
+    return fallback
+
+def ld_item_count(data) -> int:
+    """numberOfItems из ItemList (в т.ч. внутри @graph); 0, если его нет."""
+    if isinstance(data, list):
+        return max((ld_item_count(d) for d in data), default=0)
+    if isinstance(data, dict):
+        if data.get("@type") == "ItemList":
+            try:
+                return int(data.get("numberOfItems") or 0)
+            except (TypeError, ValueError):
+                return 0
+        return ld_item_count(data.get("@graph"))
+    return 0
+
+@lru_cache(maxsize=1024)               # путей категорий единицы, товаров — тысячи
+def ld_category(raw: str) -> str:
+    # "Rowery > Górskie" -> "Górskie", как предпоследняя крошка на странице товара;
+    # intern оставляет по одному объекту строки на категорию
+    return sys.intern(norm(re.split(r"[>/]", raw)[-1]))
+
+def ld_text(value) -> str:
+    """Строковое поле JSON-LD. Вместо строки бывают список или объект: берём первую строку / @id."""
+    if isinstance(value, list):
+        value = value[0] if value else ""
+    if isinstance(value, dict):
+        value = value.get("@id")
+    return value if isinstance(value, str) else ""
+
+def ld_link(data: dict) -> str:
+    """Абсолютная ссылка товара из url/@id; у @id обычно есть фрагмент (…/rower-x#product) — отрезаем."""
+    href = ld_text(data.get("url")) or ld_text(data.get("@id"))
+    return abs_url(urldefrag(href).url) if href else ""
+
+CURRENCY_SIGNS = {"PLN": "zł"}
+
+def format_price(value, currency: str = "PLN") -> str:
+    """Цена из JSON-LD (3000, "2999.99") в виде, как на странице: "3 000,00 zł" — чтобы колонка
+    не зависела от того, откуда взят товар. Нечисловое значение возвращается как есть."""
+    raw = str(value).strip()
+    try:
+        amount = Decimal(raw.replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        return raw
+    if not amount.is_finite():
+        return raw
+    text = f"{amount:,.2f}".replace(",", " ").replace(".", ",")
+    sign = CURRENCY_SIGNS.get(currency, currency)
+    return f"{text} {sign}" if sign else text
+
+def ld_price(data: dict) -> str:
+    offers = data.get("offers")
+    if isinstance(offers, list) and offers:
+        offers = offers[0]
+    if isinstance(offers, dict):
+        price = offers.get("price")
+        if price is None or price == "":
+            return ""
+        currency = offers.get("priceCurrency")
+        return format_price(price, currency if isinstance(currency, str) else "PLN")
+    return ""
+
+def ld_product(data: dict, link: str = "") -> Optional[Product]:
+    """Товар целиком из JSON-LD; None, если полей не хватает."""
+    link = link or ld_link(data)
+    title = norm(ld_text(data.get("name")))
+    price = ld_price(data)
+    category = data.get("category")
+    category = ld_category(category) if isinstance(category, str) else ""
+    if not (is_product_link(link) and title and price and category):
+        return None
+
+    image = data.get("image") or ""
+    if isinstance(image, list):
+        image = image[0] if image else ""
+    if isinstance(image, dict):
+        image = image.get("url") or ""
+    image = image if isinstance(image, str) else ""
+    description = data.get("description")
+    return Product(title=title, price=price, link=link, image=abs_url(image) if image else "",
+                   category=category, description=strip_tags(description) if isinstance(description, str) else "")
+
 
 # ---------- парсинг листинга ----------
-LIST_SELECTORS = [
+LIST_SELECTORS = [sv.compile(q) for q in (
+    "div.product-wrapper",
     ".product-miniature",
     "article.product",
     "li.product",
     "div.product",
     "div.js-product",
     "[data-id-product]",
-]
+)]
+LINK_SELECTOR = sv.compile("a[href]")
+LISTING_CLASSES = {"product-wrapper", "product-miniature", "product", "js-product", "next", "pagination-next"}
+NEXT_SELECTORS = [sv.compile(q) for q in ('a[rel="next"]', ".pagination-next a, .next a")]
+PAGE_LINK_SELECTOR = sv.compile('a[href*="page="]')
+PAGE_NUM_RE = re.compile(r"[?&]page=(\d+)")
+
+def last_page_number(soup: BeautifulSoup, url: str) -> int:
+    """Максимальный ?page=N среди ссылок пагинации этого же листинга; 0, если их нет."""
+    path = urlsplit(url).path
+    last = 0
+    for a in PAGE_LINK_SELECTOR.select(soup):
+        href = abs_url(a.get("href", ""))
+        m = PAGE_NUM_RE.search(href)
+        if m and urlsplit(href).path == path:
+            last = max(last, int(m.group(1)))
+    return last
+
+class ListingFilter(ElementFilter):
+    """parse_only для листинга: в дерево попадают только ссылки, JSON-LD и карточки/пагинация
+    (вместе с потомками), остальная разметка страницы даже не превращается в объекты."""
+
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+        attrs = attrs or {}
+        if name == "a":
+            return True
+        if name == "script":
+            return attrs.get("type") == "application/ld+json"
+        return "data-id-product" in attrs or not LISTING_CLASSES.isdisjoint(str(attrs.get("class", "")).split())
+
+    def allow_string_creation(self, string) -> bool:
+        return False
+
+LISTING_FILTER = ListingFilter()
+
+def listing_soup(html: str) -> BeautifulSoup:
+    return BeautifulSoup(html, "lxml", parse_only=LISTING_FILTER)
 
-def parse_list(url: str, page_idx: int) -> Tuple[List[str], Optional[str]]:
-    r = render(url)
-    if not r:
-        return [], None
+async def parse_list(context: BrowserContext, url: str, page_idx: int, paginate: bool = True) -> ListPage:
+    """paginate=False — число страниц уже известно, ссылки пагинации не разбираем."""
+    print(f"[PAGE] {url}")
+    html = await render(context, url)
+    if not html:
+        return ListPage([], None, {})
 
-    html = r.html.html or ""
-    if SAVE_DEBUG:
-        save_file(f"debug_page_{page_idx}.html", html)
+    if page_idx <= DEBUG_LIMIT:
+        save_debug(f"debug_page_{page_idx}.html", html)
+
+    loop = asyncio.get_running_loop()
+    soup = await loop.run_in_executor(None, listing_soup, html)
 
     links: List[str] = []
     # 1) пробуем типовые селекторы карточек
     for sel in LIST_SELECTORS:
-        cards = r.html.find(sel)
+        cards = sel.select(soup)
         if not cards:
             continue
         for c in cards:
-            a = c.find("a[href]", first=True)
-            if not a:
+            a = LINK_SELECTOR.select_one(c)
+            if a is None:
                 continue
-            href = abs_url(a.attrs.get("href", ""))
+            href = abs_url(a.get("href", ""))
             if href and is_product_link(href) and href not in links:
                 links.append(href)
         if links:
             break
+    # сколько карточек на странице — только по селекторам карточек: в плане Б попадают и меню
+    per_page = len(links)
 
     # 2) план Б: берем все ссылки на странице и фильтруем эвристикой
     if not links:
-        for a in r.html.find("a[href]"):
-            href = abs_url(a.attrs.get("href", ""))
+        for a in LINK_SELECTOR.select(soup):
+            href = abs_url(a.get("href", ""))
             if href and is_product_link(href) and href not in links:
                 links.append(href)
 
+    # 3) товары, которые листинг уже отдаёт целиком в JSON-LD, — их страницы не качаем;
+    # без описания запись неполная (как в ld_page_product) — такую страницу всё равно качаем
+    known: Dict[str, Product] = {}
+    blocks = load_ld(sc.string for sc in LD_JSON_SELECTOR.select(soup))
+    for data in walk_ld(blocks):
+        prod = ld_product(data)
+        if prod is None:
+            continue
+        if prod.link not in links:
+            links.append(prod.link)
+        if prod.description and prod.link not in known:
+            known[prod.link] = prod
+
     # пагинация
-    next_el = r.html.find('a[rel="next"]', first=True) or r.html.find(".pagination-next a, .next a", first=True)
-    next_url = abs_url(next_el.attrs["href"]) if next_el and next_el.attrs.get("href") else None
+    next_url, last_page = None, 0
+    if paginate:
+        next_el = select_first(soup, NEXT_SELECTORS)
+        next_url = abs_url(next_el["href"]) if next_el is not None and next_el.get("href") else None
+        last_page = last_page_number(soup, url)
+        if not last_page and per_page:
+            # нет номеров в ссылках — оцениваем по ItemList.numberOfItems и числу карточек
+            last_page = -(-ld_item_count(blocks) // per_page)
 
-    print(f"[LIST] page {page_idx}: links={len(links)} next={'yes' if next_url else 'no'}")
-    return links, next_url
+    print(f"[LIST] page {page_idx}: links={len(links)} json-ld={len(known)} next={'yes' if next_url else 'no'}")
+    return ListPage(links, next_url, known, last_page)
 
 
 # ---------- парсинг товара ----------
-def parse_product(url: str, idx: int) -> Optional[Product]:
-    r = render(url)
-    if not r:
+# страницы товара разбирает lexbor (selectolax): дерево строится в C, без объектов bs4
+TITLE_SELECTORS = ("h1.product-name", "h1[itemprop='name']", "h1")
+PRICE_SELECTORS = (".current-price", ".product-prices .price", "span[itemprop='price']", ".price")
+IMAGE_SELECTORS = ("img.js-qv-product-cover", ".product-cover img", "img[itemprop='image']",
+                   'meta[property="og:image"]')
+CRUMBS_SELECTOR = ".breadcrumbs a, ol.breadcrumbs a, ul.breadcrumbs a, nav.breadcrumb a"
+DESC_SELECTOR = "#description, .product-description, [itemprop='description']"
+
+def css_first_of(tree: LexborHTMLParser, selectors):
+    for q in selectors:
+        node = tree.css_first(q)
+        if node is not None:
+            return node
+    return None
+
+def node_text(node) -> str:
+    return norm(node.text(separator=" ") if node is not None else "")
+
+async def parse_product(http: aiohttp.ClientSession, url: str, idx: int, total: int,
+                        refresh: bool = False) -> Optional[Product]:
+    print(f"  [{idx}/{total}] {url}")
+    loop = asyncio.get_running_loop()
+    html, complete = await fetch_html(http, url, limit=PREFIX_BYTES, refresh=refresh)
+    if html and not complete:
+        # хватило JSON-LD из начала страницы — остальное не качаем; HTML префикса не разбираем вовсе
+        prod = ld_page_product(html, url)
+        if prod:
+            return prod
+        html, complete = await fetch_html(http, url, refresh=refresh)
+    if not html:
         return None
 
-    if SAVE_DEBUG and idx <= 5:
-        save_file(f"debug_product_{idx}.html", r.html.html or "")
+    if idx <= DEBUG_LIMIT:
+        save_debug(f"debug_product_{idx}.html", html)
+
+    # разбор HTML — CPU, уводим его с event loop
+    tree = await loop.run_in_executor(None, LexborHTMLParser, html)
+    return extract_product(tree, url)
 
-    title_el = (r.html.find("h1.product-name", first=True)
-                or r.html.find("h1[itemprop='name']", first=True)
-                or r.html.find("h1", first=True))
-    title = norm(title_el.text if title_el else "")
+def ld_page_product(html: bytes, url: str) -> Optional[Product]:
+    # только собственный Product страницы: чужой (из ItemList похожих) попал бы под ссылку url;
+    # неполный — None, тогда качается вся страница
+    data = own_ld(load_ld(m.group(1) for m in LD_JSON_RE.finditer(html)), url)
+    if data is None:
+        return None
+    prod = ld_product(data, link=url)
+    # описание обязательно: иначе его пришлось бы брать из DOM полной страницы
+    return prod if prod and prod.description else None
 
-    price_el = (r.html.find(".current-price", first=True)
-                or r.html.find(".product-prices .price", first=True)
-                or r.html.find("span[itemprop='price']", first=True)
-                or r.html.find(".price", first=True))
-    price = norm(price_el.text if price_el else "")
+def extract_product(tree: LexborHTMLParser, url: str) -> Optional[Product]:
+    title = node_text(css_first_of(tree, TITLE_SELECTORS))
+    price = node_text(css_first_of(tree, PRICE_SELECTORS))
 
-    img_el = (r.html.find("img.js-qv-product-cover", first=True)
-              or r.html.find(".product-cover img", first=True)
-              or r.html.find("img[itemprop='image']", first=True)
-              or r.html.find('meta[property="og:image"]', first=True))
+    img_el = css_first_of(tree, IMAGE_SELECTORS)
     image = ""
-    if img_el:
-        image = img_el.attrs.get("src") or img_el.attrs.get("content") or img_el.attrs.get("data-src") or ""
+    if img_el is not None:
+        attrs = img_el.attributes
+        image = attrs.get("src") or attrs.get("content") or attrs.get("data-src") or ""
         image = abs_url(image)
 
-    crumbs = r.html.find(".breadcrumbs a, ol.breadcrumbs a, ul.breadcrumbs a, nav.breadcrumb a")
+    # lexbor отдаёт узел по разу на каждую совпавшую альтернативу группы — убираем повторы,
+    # сохраняя порядок документа
+    crumbs = list({n.mem_id: n for n in tree.css(CRUMBS_SELECTOR)}.values())
     category = ""
     if crumbs:
-        category = norm(crumbs[-2].text if len(crumbs) >= 2 else crumbs[-1].text)
+        category = sys.intern(node_text(crumbs[-2] if len(crumbs) >= 2 else crumbs[-1]))
 
-    desc_el = r.html.find("#description, .product-description, [itemprop='description']", first=True)
-    description = norm(desc_el.text if desc_el else "")
+    description = node_text(tree.css_first(DESC_SELECTOR))
 
-    # fallback из JSON‑LD
+    # fallback из JSON‑LD — только из собственного Product страницы, не из похожих товаров
     if not title or not price:
-        for sc in r.html.find('script[type="application/ld+json"]'):
-            try:
-                import json
-                data = json.loads(sc.text)
-                if isinstance(data, list) and data:
-                    data = data[0]
-                if isinstance(data, dict) and data.get("@type") in ("Product", "Bike", "Thing"):
-                    title = title or norm(data.get("name") or "")
-                    offers = data.get("offers")
-                    if isinstance(offers, list) and offers:
-                        offers = offers[0]
-                    if isinstance(offers, dict):
-                        price = price or str(offers.get("price", "")).strip()
-            except Exception:
-                pass
+        data = own_ld(load_ld(sc.text() for sc in tree.css(LD_JSON_CSS)), url)
+        if data is not None:
+            title = title or norm(ld_text(data.get("name")))
+            price = price or ld_price(data)
 
     if not title:
         print(f"[WARN] skip (no title): {url}")
@@ -205,54 +563,186 @@ def parse_product(url: str, idx: int) -> Optional[Product]:
 
 
 # ---------- обход ----------
-def crawl() -> List[Product]:
-    items: List[Product] = []
+async def crawl(emit: Callable[[Product], None], page_done: Optional[Callable[[], None]] = None,
+                cache: bool = False, refresh: bool = False) -> int:
+    """Обходит каталог, отдавая каждый товар в emit сразу, как он готов. Возвращает их число.
+
+    page_done вызывается после каждой обработанной страницы листинга.
+    С cache страницы товаров берутся из CACHE_NAME, пока не устарели; refresh
+    сверяет каждую с сервером по ETag/Last-Modified и перекачивает только изменившиеся.
+    """
+    count = 0
     seen = set()
 
-    page = 1
-    page_url = abs_url(f"{START_PATH}?page={page}")
-
-    while page_url:
-        print(f"[PAGE] {page_url}")
-        links, next_url = parse_list(page_url, page)
+    async def handle(lp: ListPage):
+        nonlocal count
+        new_links = [u for u in lp.links if u not in seen]
+        seen.update(new_links)
 
-        if not links:
-            print("[INFO] Товары не найдены на странице — завершаю.")
-            break
-
-        new_links = [u for u in links if u not in seen]
         for u in new_links:
-            seen.add(u)
-
-        print(f"[INFO] к обработке: {len(new_links)}")
-        for i, link in enumerate(new_links, 1):
-            print(f"  [{i}/{len(new_links)}] {link}")
-            prod = parse_product(link, idx=i)
+            if u in lp.known:
+                emit(lp.known[u])
+                count += 1
+        to_fetch = [u for u in new_links if u not in lp.known]
+
+        # страницы товаров качаем параллельно, не более PER_HOST_CONCURRENCY запросов к сайту
+        print(f"[INFO] к обработке: {len(to_fetch)} (из JSON-LD листинга: {len(new_links) - len(to_fetch)})")
+        for fut in asyncio.as_completed([parse_product(http, link, idx=i, total=len(to_fetch), refresh=refresh)
+                                         for i, link in enumerate(to_fetch, 1)]):
+            prod = await fut
             if prod:
-                items.append(prod)
-            time.sleep(SLEEP)
-
-        if MAX_PAGES and page >= MAX_PAGES:
-            print("[INFO] Достигнут лимит страниц.")
-            break
+                emit(prod)
+                count += 1
+        if page_done:
+            page_done()
+
+    # один браузер и один контекст на весь обход, на каждый URL — только новая вкладка
+    pw = await async_playwright().start()
+    browser = await pw.chromium.launch(headless=True)
+    context = await browser.new_context(user_agent=HEADERS["User-Agent"], locale="pl-PL",
+                                        extra_http_headers={"Accept-Language": HEADERS["Accept-Language"]})
+    connector = aiohttp.TCPConnector(limit=MAX_WORKERS, limit_per_host=MAX_WORKERS, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=30)
+    if cache:
+        from aiohttp_client_cache import CachedSession, SQLiteBackend
+        # префикс (206) и полная страница (200) — разные ключи: заголовки входят в ключ,
+        # иначе сохранённые 32 КБ отдавались бы на запрос всей страницы
+        backend = SQLiteBackend(CACHE_NAME, expire_after=CACHE_EXPIRE, cache_control=True,
+                                allowed_codes=(200, 206), include_headers=True)
+        http = CachedSession(cache=backend, connector=connector, headers=HEADERS, timeout=timeout)
+    else:
+        http = aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=timeout)
+    try:
+        page = 1
+        lp = await parse_list(context, list_url(page), page)
+        visited = {list_url(page)}
+
+        last = min(lp.last_page, MAX_PAGES) if MAX_PAGES else lp.last_page
+        if last > 1:
+            # ссылки пагинации часто показывают лишь окно «1 2 3 … next», поэтому last — нижняя
+            # граница: 2..last-1 рендерим параллельно (RENDER_CONCURRENCY), а страницу last —
+            # с разбором пагинации, чтобы дальше пойти по её «next»
+            print(f"[INFO] страниц в каталоге: не меньше {lp.last_page}, параллельно обходим {last}")
+            pending = [asyncio.ensure_future(parse_list(context, list_url(n), n, paginate=False))
+                       for n in range(2, last)]
+            tail = asyncio.ensure_future(parse_list(context, list_url(last), last))
+            visited.update(list_url(n) for n in range(2, last + 1))
+            try:
+                await handle(lp)
+                for fut in asyncio.as_completed(pending):
+                    await handle(await fut)
+                lp = await tail
+            except BaseException:
+                for fut in pending + [tail]:
+                    fut.cancel()
+                raise
+            page = last
+
+        # дальше (или с самого начала, если число страниц неизвестно) — по ссылке «next»;
+        # следующий листинг рендерится, пока качаются товары текущего
+        while lp.links:
+            nxt = None
+            if MAX_PAGES and page >= MAX_PAGES:
+                print("[INFO] Достигнут лимит страниц.")
+            # «next» на последней странице иногда ведёт на уже пройденную — не ходим по кругу
+            elif lp.next_url in visited:
+                print(f"[INFO] next ведёт на пройденную страницу: {lp.next_url}")
+            elif lp.next_url:
+                visited.add(lp.next_url)
+                page += 1
+                nxt = asyncio.ensure_future(parse_list(context, lp.next_url, page))
 
-        page += 1
-        page_url = next_url
-        time.sleep(SLEEP)
+            try:
+                await handle(lp)
+            except BaseException:
+                if nxt is not None:
+                    nxt.cancel()
+                raise
+            if nxt is None:
+                break
+            lp = await nxt
+        else:
+            print("[INFO] Товары не найдены на странице — завершаю.")
+    finally:
+        await http.close()
+        await browser.close()
+        await pw.stop()
 
-    return items
+    return count
 
 
 def main():
+    ap = argparse.ArgumentParser(description="Sprint-Rowery scraper")
+    ap.add_argument("--xlsx", action="store_true", help="дополнительно писать output.xlsx")
+    ap.add_argument("--parquet", action="store_true", help="дополнительно писать output.parquet (zstd)")
+    ap.add_argument("--cache", action="store_true", help=f"кэшировать страницы товаров в {CACHE_NAME}")
+    ap.add_argument("--refresh", action="store_true", help="с --cache: сверить кэш с сайтом условными запросами (ETag / Last-Modified)")
+    args = ap.parse_args()
+    if args.refresh and not args.cache:
+        ap.error("--refresh работает только вместе с --cache")
+
     t0 = time.time()
-    products = crawl()
-    if products:
-        df = pd.DataFrame([asdict(p) for p in products])
-        df.to_csv("output.csv", index=False)
-        df.to_excel("output.xlsx", index=False)
-        print(f"[OK] Сохранено {len(df)} товаров -> output.csv, output.xlsx")
+    # строки пишутся сразу, а буфер сбрасывается на диск после каждой страницы листинга,
+    # поэтому и после Ctrl+C, и после падения в файле остаётся всё, кроме текущей страницы
+    with open("output.csv", "w", newline="", encoding="utf-8-sig") as f:
+        # csv.writer пишет список целиком в C; DictWriter на каждой строке сверяет ключи в Python
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+
+        book = sheet = None
+        if args.xlsx:
+            import xlsxwriter
+            # ссылки пишем обычным текстом: иначе каждая ячейка проверяется регуляркой и становится
+            # гиперссылкой, а Excel допускает их не больше 65 530 на лист
+            book = xlsxwriter.Workbook("output.xlsx", {"constant_memory": True, "strings_to_urls": False})
+            sheet = book.add_worksheet()
+            sheet.write_row(0, 0, FIELDS)
+
+        pq_writer = pa = None
+        if args.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq_writer = pq.ParquetWriter("output.parquet", pa.schema([(k, pa.string()) for k in FIELDS]),
+                                         compression="zstd")
+        # колонки для parquet копятся до PARQUET_BATCH строк: мелкие row group раздувают файл
+        columns: List[List[str]] = [[] for _ in FIELDS]
+
+        def flush_parquet():
+            if columns[0]:
+                pq_writer.write_batch(pa.record_batch([pa.array(c, pa.string()) for c in columns], names=FIELDS))
+                for c in columns:
+                    c.clear()
+
+        rows = 0
+
+        def save(p: Product):
+            nonlocal rows
+            row = product_row(p)
+            writer.writerow(row)
+            rows += 1
+            if sheet is not None:
+                sheet.write_row(rows, 0, row)
+            if pq_writer is not None:
+                for c, v in zip(columns, row):
+                    c.append(v)
+                if len(columns[0]) >= PARQUET_BATCH:
+                    flush_parquet()
+
+        try:
+            count = asyncio.run(crawl(save, page_done=f.flush, cache=args.cache, refresh=args.refresh))
+        finally:
+            if book is not None:
+                book.close()
+            if pq_writer is not None:
+                flush_parquet()
+                pq_writer.close()
+
+    outputs = ", ".join(name for name, on in (("output.csv", True), ("output.xlsx", args.xlsx),
+                                              ("output.parquet", args.parquet)) if on)
+    if count:
+        print(f"[OK] Сохранено {count} товаров -> {outputs}")
     else:
-        print("Пусто — сохранять нечего.")
+        print("Пусто — товары не найдены.")
     print(f"⏱ За {time.time() - t0:.1f} сек.")
 
 